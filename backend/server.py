@@ -12,13 +12,25 @@ sys.stdout = os.fdopen(sys.stdout.fileno(), "w", buffering=1)
 sys.stderr = os.fdopen(sys.stderr.fileno(), "w", buffering=1)
 
 import asyncio  # noqa: E402
-import json  # noqa: E402
+import logging  # noqa: E402
+import multiprocessing  # noqa: E402
+import multiprocessing.connection  # noqa: E402
 import random  # noqa: E402
 import signal  # noqa: E402
-from collections import defaultdict  # noqa: E402
-from datetime import datetime, timedelta  # noqa: E402
-from websockets.server import serve  # noqa: E402
+import time  # noqa: E402
+from collections import OrderedDict, deque  # noqa: E402
+from http import HTTPStatus  # noqa: E402
+from websockets.asyncio.server import serve  # noqa: E402
+import uvloop  # noqa: E402
 import websockets  # noqa: E402
+import orjson  # noqa: E402
+
+logging.basicConfig(
+    format="[%(asctime)s] %(message)s", level=logging.INFO, stream=sys.stdout
+)
+logger = logging.getLogger(__name__)
+# websockets logs every rejected (health check) handshake at INFO
+logging.getLogger("websockets").setLevel(logging.WARNING)
 
 # Lists for generating friendly pod names
 ADJECTIVES = [
@@ -92,21 +104,58 @@ class WebSocketServer:
     MAX_CONNECTIONS = 100  # Max concurrent connections
     RATE_LIMIT_WINDOW = 1  # seconds
     RATE_LIMIT_MAX_REQUESTS = 2  # max requests per window (2 pings/sec max)
+    MAX_RATE_LIMIT_ENTRIES = MAX_CONNECTIONS * 4  # LRU cap on tracked clients
     TERMINATE_COOLDOWN = 30  # seconds between terminate requests
-
-    def __init__(self, host="0.0.0.0", port=8080):
+    MAX_TIMESTAMP_LENGTH = 40  # ISO timestamps from the client are 24 chars
+    # Valid messages are compact JSON starting with a known type (JSON.stringify output)
+    MESSAGE_PREFIXES = (b'{"type":"ping"', b'{"type":"terminate"')
+
+    # Pre-serialized error responses (constant, so encode once instead of per message).
+    # Frames are sent as bytes with text=True, so browsers still receive text frames.
+    ERR_TOO_LARGE = orjson.dumps({"type": "error", "message": "Message too large"})
+    ERR_RATE_LIMIT = orjson.dumps(
+        {
+            "type": "error",
+            "message": f"Rate limit exceeded. Max {RATE_LIMIT_MAX_REQUESTS} requests per second.",
+        }
+    )
+    ERR_BAD_TYPE = orjson.dumps({"type": "error", "message": "Invalid message type"})
+    ERR_BAD_TIMESTAMP = orjson.dumps({"type": "error", "message": "Invalid timestamp"})
+    ERR_BAD_JSON = orjson.dumps({"type": "error", "message": "Invalid JSON format"})
+    ERR_INTERNAL = orjson.dumps({"type": "error", "message": "Internal error"})
+
+    def __init__(self, host="0.0.0.0", port=8080, friendly_name=None, reuse_port=False):
         self.host = host
         self.port = port
+        self.reuse_port = reuse_port  # Share the port with sibling worker processes
         self.k8s_pod_name = os.getenv("POD_NAME", "unknown-pod")
         self.session_id = os.getenv("SESSION_ID", None)
-        self.friendly_name = self._generate_friendly_name()
+        self.friendly_name = friendly_name or self._generate_friendly_name()
         self.region = os.getenv("AWS_REGION", "unknown-region")
         self.shutdown_event = asyncio.Event()
         self.active_connections = 0
-        self.rate_limiter = defaultdict(list)  # Track request timestamps per client
+        # Track the most recent request timestamps per client (least recently seen first)
+        self.rate_limiter = OrderedDict()
         self.last_terminate_time = None
-
-    def _generate_friendly_name(self):
+        # Pong frames are assembled from this pre-serialized constant prefix plus the
+        # two per-message timestamps, instead of building and encoding a dict
+        self.pong_prefix = (
+            b'{"type":"pong","pod_name":'
+            + orjson.dumps(self.friendly_name)
+            + b',"region":'
+            + orjson.dumps(self.region)
+            + b',"session_id":'
+            + orjson.dumps(self.session_id)
+            + b',"timestamp":"'
+        )
+        # Dispatch table for client messages; its keys are the allowed message types
+        self.message_handlers = {
+            "ping": self._handle_ping,
+            "terminate": self._handle_terminate,
+        }
+
+    @staticmethod
+    def _generate_friendly_name():
         """Generate a friendly, memorable pod name."""
         adjective = random.choice(ADJECTIVES)
         noun = random.choice(NOUNS)
@@ -114,209 +163,226 @@ class WebSocketServer:
         number = random.randint(100, 999)
         return f"{adjective}-{noun}-{number}"
 
-    def _check_rate_limit(self, client_id):
+    def _check_rate_limit(self, client_key):
         """Check if client has exceeded rate limit."""
-        now = datetime.now()
-        # Clean old requests outside the window
-        cutoff = now - timedelta(seconds=self.RATE_LIMIT_WINDOW)
-        self.rate_limiter[client_id] = [
-            ts for ts in self.rate_limiter[client_id] if ts > cutoff
-        ]
-
-        # Check if limit exceeded
-        if len(self.rate_limiter[client_id]) >= self.RATE_LIMIT_MAX_REQUESTS:
+        now = time.monotonic()
+        requests = self.rate_limiter.get(client_key)
+        if requests is None:
+            requests = deque(maxlen=self.RATE_LIMIT_MAX_REQUESTS)
+            self.rate_limiter[client_key] = requests
+            # Evict the least recently seen client if entries leaked past disconnect
+            if len(self.rate_limiter) > self.MAX_RATE_LIMIT_ENTRIES:
+                self.rate_limiter.popitem(last=False)
+        else:
+            self.rate_limiter.move_to_end(client_key)
+
+        # Timestamps are ordered, so only the oldest retained one matters
+        if (
+            len(requests) == requests.maxlen
+            and now - requests[0] < self.RATE_LIMIT_WINDOW
+        ):
             return False
 
-        # Add current request
-        self.rate_limiter[client_id].append(now)
+        # Add current request (deque drops the oldest once full)
+        requests.append(now)
         return True
 
     def _can_terminate(self):
         """Check if terminate request is allowed (cooldown period)."""
         if self.last_terminate_time is None:
             return True
-        elapsed = (datetime.now() - self.last_terminate_time).total_seconds()
+        elapsed = time.monotonic() - self.last_terminate_time
         return elapsed >= self.TERMINATE_COOLDOWN
 
+    async def _handle_ping(self, websocket, data):
+        """Reply to a ping with a pong carrying pod information."""
+        # Validate timestamp format
+        timestamp = data.get("timestamp")
+        if (
+            not isinstance(timestamp, str)
+            or len(timestamp) >= self.MAX_TIMESTAMP_LENGTH
+            or not timestamp.isascii()
+        ):
+            await websocket.send(self.ERR_BAD_TIMESTAMP, text=True)
+            return
+
+        # Server timestamp is epoch milliseconds; clients only use
+        # client_timestamp for latency. orjson still quotes/escapes the echoed value.
+        frame = b"".join(
+            (
+                self.pong_prefix,
+                b"%d" % (time.time_ns() // 1_000_000),
+                b'","client_timestamp":',
+                orjson.dumps(timestamp),
+                b"}",
+            )
+        )
+        await websocket.send(frame, text=True)
+
+    async def _handle_terminate(self, websocket, data):
+        """Shut the pod down on client request, subject to the cooldown."""
+        # Check cooldown period
+        if not self._can_terminate():
+            remaining = self.TERMINATE_COOLDOWN - (
+                time.monotonic() - self.last_terminate_time
+            )
+            error_response = {
+                "type": "error",
+                "message": f"Terminate cooldown active. Wait {int(remaining)}s",
+            }
+            await websocket.send(orjson.dumps(error_response), text=True)
+            return
+
+        # Client requested pod termination
+        self.last_terminate_time = time.monotonic()
+        host, port = websocket.remote_address[:2]
+        logger.info("Termination requested by client %s:%s", host, port)
+        response = {
+            "type": "terminating",
+            "message": "Pod termination initiated",
+            "pod_name": self.friendly_name,
+            "region": self.region,
+        }
+        # send() returns once the frame is flushed, so the client sees this reply
+        await websocket.send(orjson.dumps(response), text=True)
+        # Trigger graceful shutdown
+        self.shutdown_event.set()
+
     async def handle_client(self, websocket):
         """Handle WebSocket connection from a client."""
-        client_id = f"{websocket.remote_address[0]}:{websocket.remote_address[1]}"
+        # remote_address is a hashable (host, port, ...) tuple, so key on it directly
+        # and leave formatting it to the log calls
+        client_key = websocket.remote_address
+        host, port = client_key[:2]
 
         # Connection limit check
         if self.active_connections >= self.MAX_CONNECTIONS:
-            print(
-                f"[{datetime.now().isoformat()}] Connection rejected: max connections reached"
-            )
+            logger.info("Connection rejected: max connections reached")
             await websocket.close(1008, "Too many connections")
             return
 
         self.active_connections += 1
-        print(
-            f"[{datetime.now().isoformat()}] Client connected: {client_id} ({self.active_connections} active)"
+        logger.info(
+            "Client connected: %s:%s (%d active)", host, port, self.active_connections
         )
 
         try:
-            async for message in websocket:
+            while True:
+                # Receive raw bytes: orjson parses them directly, skipping UTF-8 decoding
+                message = await websocket.recv(decode=False)
+
                 # Message size validation
                 if len(message) > self.MAX_MESSAGE_SIZE:
-                    error_response = {"type": "error", "message": "Message too large"}
-                    await websocket.send(json.dumps(error_response))
+                    await websocket.send(self.ERR_TOO_LARGE, text=True)
                     continue
 
                 # Rate limiting
-                if not self._check_rate_limit(client_id):
-                    error_response = {
-                        "type": "error",
-                        "message": "Rate limit exceeded. Max 2 requests per second.",
-                    }
-                    await websocket.send(json.dumps(error_response))
+                if not self._check_rate_limit(client_key):
+                    await websocket.send(self.ERR_RATE_LIMIT, text=True)
+                    continue
+
+                # Reject anything that can't be a known message before parsing it
+                if not message.startswith(self.MESSAGE_PREFIXES):
+                    await websocket.send(self.ERR_BAD_TYPE, text=True)
                     continue
 
                 try:
-                    data = json.loads(message)
+                    data = orjson.loads(message)
 
                     # Input validation - only allow known message types
                     message_type = data.get("type")
-                    if message_type not in ["ping", "terminate"]:
-                        error_response = {
-                            "type": "error",
-                            "message": "Invalid message type",
-                        }
-                        await websocket.send(json.dumps(error_response))
+                    handler = (
+                        self.message_handlers.get(message_type)
+                        if isinstance(message_type, str)
+                        else None
+                    )
+                    if handler is None:
+                        await websocket.send(self.ERR_BAD_TYPE, text=True)
                         continue
 
-                    if message_type == "ping":
-                        # Validate timestamp format
-                        timestamp = data.get("timestamp")
-                        if not isinstance(timestamp, str):
-                            error_response = {
-                                "type": "error",
-                                "message": "Invalid timestamp",
-                            }
-                            await websocket.send(json.dumps(error_response))
-                            continue
-
-                        # Respond with pong including pod information
-                        response = {
-                            "type": "pong",
-                            "timestamp": datetime.now().isoformat(),
-                            "pod_name": self.friendly_name,
-                            "region": self.region,
-                            "client_timestamp": timestamp,
-                            "session_id": self.session_id,
-                        }
-                        await websocket.send(json.dumps(response))
-
-                    elif message_type == "terminate":
-                        # Check cooldown period
-                        if not self._can_terminate():
-                            remaining = (
-                                self.TERMINATE_COOLDOWN
-                                - (
-                                    datetime.now() - self.last_terminate_time
-                                ).total_seconds()
-                            )
-                            error_response = {
-                                "type": "error",
-                                "message": f"Terminate cooldown active. Wait {int(remaining)}s",
-                            }
-                            await websocket.send(json.dumps(error_response))
-                            continue
-
-                        # Client requested pod termination
-                        self.last_terminate_time = datetime.now()
-                        print(
-                            f"[{datetime.now().isoformat()}] Termination requested by client {client_id}"
-                        )
-                        response = {
-                            "type": "terminating",
-                            "message": "Pod termination initiated",
-                            "pod_name": self.friendly_name,
-                            "region": self.region,
-                        }
-                        await websocket.send(json.dumps(response))
-                        # Trigger graceful shutdown
-                        self.shutdown_event.set()
-
-                except json.JSONDecodeError:
-                    error_response = {"type": "error", "message": "Invalid JSON format"}
-                    await websocket.send(json.dumps(error_response))
+                    await handler(websocket, data)
+
+                except orjson.JSONDecodeError:
+                    await websocket.send(self.ERR_BAD_JSON, text=True)
                 except Exception as e:
-                    print(
-                        f"[{datetime.now().isoformat()}] Error processing message: {e}"
-                    )
-                    error_response = {"type": "error", "message": "Internal error"}
-                    await websocket.send(json.dumps(error_response))
+                    logger.error("Error processing message: %s", e)
+                    await websocket.send(self.ERR_INTERNAL, text=True)
 
         except websockets.exceptions.ConnectionClosed:
-            print(f"[{datetime.now().isoformat()}] Client disconnected: {client_id}")
+            logger.info("Client disconnected: %s:%s", host, port)
         except Exception as e:
-            print(
-                f"[{datetime.now().isoformat()}] Error handling client {client_id}: {e}"
-            )
+            logger.error("Error handling client %s:%s: %s", host, port, e)
         finally:
             # Decrement connection count
             self.active_connections -= 1
             # Clean up rate limiter entry
-            if client_id in self.rate_limiter:
-                del self.rate_limiter[client_id]
-            print(
-                f"[{datetime.now().isoformat()}] Client cleanup: {client_id} ({self.active_connections} active)"
+            self.rate_limiter.pop(client_key, None)
+            logger.info(
+                "Client cleanup: %s:%s (%d active)", host, port, self.active_connections
             )
 
-    async def health_check_handler(self, path, request_headers):
+    async def health_check_handler(self, connection, request):
         """Health check endpoint for Kubernetes probes."""
-        if path == "/health":
+        if request.path == "/health":
+            response = connection.respond(HTTPStatus.OK, "OK")
             # Security headers
-            headers = [
-                ("X-Content-Type-Options", "nosniff"),
-                ("X-Frame-Options", "DENY"),
-                ("X-XSS-Protection", "1; mode=block"),
-                ("Content-Security-Policy", "default-src 'none'"),
-            ]
-            return (200, headers, b"OK")
+            response.headers["X-Content-Type-Options"] = "nosniff"
+            response.headers["X-Frame-Options"] = "DENY"
+            response.headers["X-XSS-Protection"] = "1; mode=block"
+            response.headers["Content-Security-Policy"] = "default-src 'none'"
+            return response
         return None
 
     async def run(self):
         """Start the WebSocket server."""
-        print(
-            f"[{datetime.now().isoformat()}] Starting WebSocket server on {self.host}:{self.port}"
-        )
-        print(f"[{datetime.now().isoformat()}] K8s Pod: {self.k8s_pod_name}")
-        print(f"[{datetime.now().isoformat()}] Session ID: {self.session_id or 'N/A'}")
-        print(f"[{datetime.now().isoformat()}] Friendly Name: {self.friendly_name}")
-        print(f"[{datetime.now().isoformat()}] Region: {self.region}")
-
-        async with serve(
-            self.handle_client,
-            self.host,
-            self.port,
-            process_request=self.health_check_handler,
-            max_size=self.MAX_MESSAGE_SIZE,  # Enforce max message size at protocol level
-            ping_interval=None,  # Disable protocol pings - strict SPI firewalls may block them
-            ping_timeout=None,  # Disable protocol ping timeout
-            close_timeout=10,
-            compression=None,  # Disable compression - some firewalls drop compressed WebSocket frames
+        logger.info("Starting WebSocket server on %s:%s", self.host, self.port)
+        logger.info("K8s Pod: %s", self.k8s_pod_name)
+        logger.info("Session ID: %s", self.session_id or "N/A")
+        logger.info("Friendly Name: %s", self.friendly_name)
+        logger.info("Region: %s", self.region)
+
+        async with (
+            serve(
+                self.handle_client,
+                self.host,
+                self.port,
+                process_request=self.health_check_handler,
+                max_size=self.MAX_MESSAGE_SIZE,  # Enforce max message size at protocol level
+                ping_interval=None,  # Disable protocol pings - strict SPI firewalls may block them
+                ping_timeout=None,  # Disable protocol ping timeout
+                close_timeout=10,
+                compression=None,  # Disable compression - some firewalls drop compressed WebSocket frames
+                max_queue=8,  # Cap buffered incoming frames per connection
+                write_limit=2**14,  # Cap per-connection write buffer (bytes)
+                reuse_port=self.reuse_port,  # SO_REUSEPORT: kernel spreads accepts across workers
+            ) as server
         ):
-            print(f"[{datetime.now().isoformat()}] WebSocket server running")
+            logger.info("WebSocket server running")
             await self.shutdown_event.wait()
-            print(f"[{datetime.now().isoformat()}] Shutting down gracefully...")
+            logger.info("Shutting down gracefully...")
+            # Close every connection with 1001 (going away) and wait for the closing
+            # handshakes, so in-flight frames are delivered and clients reconnect promptly
+            await asyncio.gather(
+                *(
+                    connection.close(1001, "going away")
+                    for connection in set(server.connections)
+                ),
+                return_exceptions=True,
+            )
 
 
 def signal_handler(server):
     """Handle shutdown signals."""
 
     def handler(signum, frame):
-        print(
-            f"\n[{datetime.now().isoformat()}] Received signal {signum}, initiating shutdown..."
-        )
+        logger.info("Received signal %s, initiating shutdown...", signum)
         server.shutdown_event.set()
 
     return handler
 
 
-async def main():
-    server = WebSocketServer()
+async def main(friendly_name=None, reuse_port=False):
+    server = WebSocketServer(friendly_name=friendly_name, reuse_port=reuse_port)
 
     # Register signal handlers for graceful shutdown
     signal.signal(signal.SIGTERM, signal_handler(server))
@@ -325,9 +391,50 @@ async def main():
     await server.run()
 
 
-if __name__ == "__main__":
+def run_worker(friendly_name=None, reuse_port=False):
+    """Run one server event loop in the current process."""
     try:
-        asyncio.run(main())
+        uvloop.run(main(friendly_name, reuse_port))
     except KeyboardInterrupt:
-        print(f"\n[{datetime.now().isoformat()}] Server stopped")
-        sys.exit(0)
+        logger.info("Server stopped")
+
+
+def run_workers(workers):
+    """Run several worker processes bound to the same port via SO_REUSEPORT."""
+    # All workers report the same pod name; connection state is per worker
+    friendly_name = WebSocketServer._generate_friendly_name()
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(friendly_name, True),
+            name=f"websocket-worker-{i}",
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop_workers(signum=None, frame=None):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+
+    # A terminate request (or crash) in any worker takes the whole pod down
+    multiprocessing.connection.wait([process.sentinel for process in processes])
+    stop_workers()
+    for process in processes:
+        process.join()
+    logger.info("All workers stopped")
+
+
+if __name__ == "__main__":
+    workers = int(os.getenv("WEBSOCKET_WORKERS", "1"))
+    if workers > 1:
+        logger.info("Starting %d worker processes", workers)
+        run_workers(workers)
+    else:
+        run_worker()
+    sys.exit(0)
@@ -12,17 +12,49 @@ sys.stdout = os.fdopen(sys.stdout.fileno(), "w", buffering=1)
 sys.stderr = os.fdopen(sys.stderr.fileno(), "w", buffering=1)
 
 import asyncio  # noqa: E402
-import uuid  # noqa: E402
-from datetime import datetime  # noqa: E402
-from aiohttp import web  # noqa: E402
+import logging  # noqa: E402
+import secrets  # noqa: E402
+import ssl  # noqa: E402
+import time  # noqa: E402
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
+import uvloop  # noqa: E402
+import orjson  # noqa: E402
+from aiohttp import ClientSession, TCPConnector, web  # noqa: E402
 from aiohttp_cors import setup as cors_setup, ResourceOptions  # noqa: E402
-from kubernetes import client, config  # noqa: E402
+from kubernetes import client, config, watch  # noqa: E402
 from kubernetes.client.rest import ApiException  # noqa: E402
+import urllib3  # noqa: E402
+
+logging.basicConfig(
+    format="[%(asctime)s] %(message)s", level=logging.INFO, stream=sys.stdout
+)
+logger = logging.getLogger(__name__)
+# Keep per-request access logs (health probes) out of the output, as before
+logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+
+
+def json_response(data, status=200):
+    """Build a JSON response serialized with orjson (bytes body, no str round trip)."""
+    return web.Response(
+        body=orjson.dumps(data), status=status, content_type="application/json"
+    )
+
+
+@web.middleware
+async def health_check(request, handler):
+    """Health check endpoint, answered before any route handler or CORS wrapping."""
+    if request.path == "/health":
+        return web.Response(body=b"OK", content_type="text/plain")
+    return await handler(request)
 
 
 class SessionProvisioner:
     """Provisions dedicated Kubernetes pods for WebSocket sessions."""
 
+    # Stands in for the session ID in the pre-serialized Job manifest templates
+    SESSION_ID_PLACEHOLDER = "__SESSION_ID__"
+    POOL_CHECK_INTERVAL = 30  # seconds between pool checks when nothing triggers one
+
     def __init__(self, namespace=None, pool_size=None):
         self.namespace = namespace or os.getenv("NAMESPACE", "resume-showcase")
         self.pool_size = pool_size or int(os.getenv("POOL_SIZE", "4"))
@@ -31,54 +63,56 @@ class SessionProvisioner:
         self.ecr_image = ecr_url if ":" in ecr_url else f"{ecr_url}:latest"
         self.aws_region = os.getenv("AWS_REGION", "us-east-1")
         self.available_pods = []  # Pool of warm pods ready for assignment
+        self.pending_pods = 0  # Warm pods being created, counted toward the pool
+        self.replenish_trigger = asyncio.Event()  # Set when a warm pod is taken
 
-        print(f"[{datetime.now().isoformat()}] Initializing SessionProvisioner")
-        print(f"[{datetime.now().isoformat()}] Namespace: {self.namespace}")
-        print(f"[{datetime.now().isoformat()}] ECR Image: {self.ecr_image}")
-        print(f"[{datetime.now().isoformat()}] AWS Region: {self.aws_region}")
+        logger.info("Initializing SessionProvisioner")
+        logger.info("Namespace: %s", self.namespace)
+        logger.info("ECR Image: %s", self.ecr_image)
+        logger.info("AWS Region: %s", self.aws_region)
 
         # Load Kubernetes config
         try:
-            print(
-                f"[{datetime.now().isoformat()}] Loading in-cluster Kubernetes config..."
-            )
+            logger.info("Loading in-cluster Kubernetes config...")
             config.load_incluster_config()
-            print(
-                f"[{datetime.now().isoformat()}] Successfully loaded in-cluster config"
-            )
+            logger.info("Successfully loaded in-cluster config")
         except config.ConfigException as e:
-            print(
-                f"[{datetime.now().isoformat()}] Failed to load in-cluster config: {e}"
-            )
-            print(f"[{datetime.now().isoformat()}] Falling back to kubeconfig...")
+            logger.warning("Failed to load in-cluster config: %s", e)
+            logger.info("Falling back to kubeconfig...")
             try:
                 config.load_kube_config()
-                print(f"[{datetime.now().isoformat()}] Successfully loaded kubeconfig")
+                logger.info("Successfully loaded kubeconfig")
             except Exception as kube_err:
-                print(
-                    f"[{datetime.now().isoformat()}] ERROR: Failed to load any Kubernetes config: {kube_err}"
-                )
+                logger.error("Failed to load any Kubernetes config: %s", kube_err)
                 raise
 
         self.batch_v1 = client.BatchV1Api()
         self.core_v1 = client.CoreV1Api()
-        print(f"[{datetime.now().isoformat()}] Kubernetes API clients initialized")
+        logger.info("Kubernetes API clients initialized")
+
+        # Jobs are POSTed directly to the API server from pre-serialized templates
+        # (only the session ID varies), skipping the client's model serialization
+        self.jobs_url = f"{self.batch_v1.api_client.configuration.host}/apis/batch/v1/namespaces/{self.namespace}/jobs"
+        self.http_session = None  # Created lazily, needs a running event loop
+        self._job_template = orjson.dumps(
+            self._create_job_manifest(self.SESSION_ID_PLACEHOLDER)
+        )
+        self._warm_job_template = orjson.dumps(
+            self._create_job_manifest(self.SESSION_ID_PLACEHOLDER, warm=True)
+        )
 
     async def initialize_pod_pool(self):
         """Initialize the pool of warm pods ready for sessions."""
         if self.pool_size == 0:
-            print(
-                f"[{datetime.now().isoformat()}] Pod pool disabled (size=0), skipping initialization"
-            )
+            logger.info("Pod pool disabled (size=0), skipping initialization")
             return
 
-        print(
-            f"[{datetime.now().isoformat()}] Initializing pod pool with {self.pool_size} pods..."
-        )
+        logger.info("Initializing pod pool with %d pods...", self.pool_size)
 
         # Check for existing warm pods
         try:
-            pods = self.core_v1.list_namespaced_pod(
+            pods = await asyncio.to_thread(
+                self.core_v1.list_namespaced_pod,
                 namespace=self.namespace,
                 label_selector="app=websocket-server,pool=warm,assigned=false",
             )
@@ -97,81 +131,90 @@ class SessionProvisioner:
                             "pod_ip": pod.status.pod_ip,
                         }
                     )
-            print(
-                f"[{datetime.now().isoformat()}] Found {len(self.available_pods)} existing warm pods"
-            )
+            logger.info("Found %d existing warm pods", len(self.available_pods))
         except Exception as e:
-            print(f"[{datetime.now().isoformat()}] Error checking existing pods: {e}")
+            logger.error("Error checking existing pods: %s", e)
 
         # Create additional warm pods if needed
-        while len(self.available_pods) < self.pool_size:
-            try:
-                session_id = self._generate_session_id()
-                await self._create_warm_pod(session_id)
-            except Exception as e:
-                print(f"[{datetime.now().isoformat()}] Error creating warm pod: {e}")
-                break
+        await self._fill_pod_pool()
+
+    async def _fill_pod_pool(self):
+        """Create all missing warm pods concurrently."""
+        # In-flight creations count toward the target so overlapping calls don't overshoot
+        deficit = self.pool_size - len(self.available_pods) - self.pending_pods
+        if deficit <= 0:
+            return
+
+        self.pending_pods += deficit
+        try:
+            results = await asyncio.gather(
+                *(
+                    self._create_warm_pod(self._generate_session_id())
+                    for _ in range(deficit)
+                ),
+                return_exceptions=True,
+            )
+        finally:
+            self.pending_pods -= deficit
+
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Error creating warm pod: %s", result)
 
     async def _create_warm_pod(self, session_id):
         """Create a warm pod that's ready to be assigned to a session."""
-        job_manifest = self._create_job_manifest(session_id)
-        # Add pool labels
-        job_manifest["metadata"]["labels"]["pool"] = "warm"
-        job_manifest["metadata"]["labels"]["assigned"] = "false"
-        job_manifest["spec"]["template"]["metadata"]["labels"]["pool"] = "warm"
-        job_manifest["spec"]["template"]["metadata"]["labels"]["assigned"] = "false"
-
-        print(
-            f"[{datetime.now().isoformat()}] Creating warm pod for session: {session_id}"
-        )
+        logger.info("Creating warm pod for session: %s", session_id)
 
         # Create the job
-        self.batch_v1.create_namespaced_job(namespace=self.namespace, body=job_manifest)
+        await self._create_job(self._warm_job_template, session_id)
 
         # Wait for pod to be ready
         pod_details = await self._wait_for_pod_ready(session_id, timeout=90)
 
         if pod_details:
             self.available_pods.append(pod_details)
-            print(
-                f"[{datetime.now().isoformat()}] Warm pod ready: {pod_details['pod_name']}"
-            )
+            logger.info("Warm pod ready: %s", pod_details["pod_name"])
         else:
-            print(
-                f"[{datetime.now().isoformat()}] Warm pod creation timed out for session: {session_id}"
-            )
+            logger.warning("Warm pod creation timed out for session: %s", session_id)
 
     async def maintain_pod_pool(self):
         """Background task to maintain the pool of warm pods."""
         while True:
+            # Woken by create_session when it takes a warm pod; the timeout also
+            # rechecks the pool periodically so failed creations get retried
+            try:
+                await asyncio.wait_for(
+                    self.replenish_trigger.wait(), timeout=self.POOL_CHECK_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+            self.replenish_trigger.clear()
+
             try:
                 # Skip if pool is disabled
                 if self.pool_size == 0:
-                    await asyncio.sleep(30)
                     continue
 
                 # Check pool size and replenish if needed
                 if len(self.available_pods) < self.pool_size:
-                    print(
-                        f"[{datetime.now().isoformat()}] Pod pool below threshold ({len(self.available_pods)}/{self.pool_size}), creating new warm pod..."
+                    logger.info(
+                        "Pod pool below threshold (%d/%d), creating warm pods...",
+                        len(self.available_pods),
+                        self.pool_size,
                     )
-                    session_id = self._generate_session_id()
-                    await self._create_warm_pod(session_id)
+                    await self._fill_pod_pool()
             except Exception as e:
-                print(f"[{datetime.now().isoformat()}] Error maintaining pod pool: {e}")
-
-            # Wait before checking again
-            await asyncio.sleep(5)
+                logger.error("Error maintaining pod pool: %s", e)
 
     def _generate_session_id(self):
         """Generate a unique session ID."""
-        return str(uuid.uuid4())[:8]
+        return secrets.token_hex(4)
 
-    def _create_job_manifest(self, session_id):
+    def _create_job_manifest(self, session_id, warm=False):
         """Create a Kubernetes Job manifest for a WebSocket session pod."""
         job_name = f"websocket-session-{session_id}"
 
-        return {
+        job_manifest = {
             "apiVersion": "batch/v1",
             "kind": "Job",
             "metadata": {
@@ -234,53 +277,106 @@ class SessionProvisioner:
             },
         }
 
+        if warm:
+            # Add pool labels
+            job_manifest["metadata"]["labels"]["pool"] = "warm"
+            job_manifest["metadata"]["labels"]["assigned"] = "false"
+            job_manifest["spec"]["template"]["metadata"]["labels"]["pool"] = "warm"
+            job_manifest["spec"]["template"]["metadata"]["labels"]["assigned"] = "false"
+
+        return job_manifest
+
+    async def _create_job(self, template, session_id):
+        """Create a Job by POSTing a pre-serialized manifest template to the API server."""
+        api_config = self.batch_v1.api_client.configuration
+        if self.http_session is None:
+            self.http_session = ClientSession(
+                connector=TCPConnector(ssl=self._create_ssl_context(api_config))
+            )
+
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        # Refreshes the in-cluster service account token when it has rotated
+        token = api_config.get_api_key_with_prefix("authorization")
+        if token:
+            headers["Authorization"] = token
+
+        body = template.replace(
+            self.SESSION_ID_PLACEHOLDER.encode(), session_id.encode()
+        )
+        async with self.http_session.post(
+            self.jobs_url, data=body, headers=headers
+        ) as resp:
+            if resp.status >= 400:
+                error = ApiException(status=resp.status, reason=resp.reason)
+                error.body = await resp.text()
+                raise error
+
+    @staticmethod
+    def _create_ssl_context(api_config):
+        """Build an SSL context matching the Kubernetes client configuration."""
+        if not api_config.verify_ssl:
+            return False
+        ssl_context = ssl.create_default_context(cafile=api_config.ssl_ca_cert)
+        if api_config.cert_file:
+            ssl_context.load_cert_chain(api_config.cert_file, api_config.key_file)
+        return ssl_context
+
     async def _wait_for_pod_ready(self, session_id, timeout=60):
         """Wait for the pod to be ready and return its details."""
-        start_time = datetime.now()
+        pod_details = await asyncio.to_thread(
+            self._watch_pod_ready, session_id, timeout
+        )
+        if pod_details is None:
+            raise TimeoutError(
+                f"Pod for session {session_id} did not become ready within {timeout}s"
+            )
+        return pod_details
+
+    def _watch_pod_ready(self, session_id, timeout):
+        """Block on a pod watch stream until the session pod is ready (runs in a thread)."""
+        deadline = time.monotonic() + timeout
+        watcher = watch.Watch()
 
-        while (datetime.now() - start_time).total_seconds() < timeout:
+        while (remaining := deadline - time.monotonic()) > 0:
             try:
-                # Find pod with session label
-                pods = self.core_v1.list_namespaced_pod(
-                    namespace=self.namespace, label_selector=f"session-id={session_id}"
-                )
+                # Each (re)started watch first replays the current pod state
+                for event in watcher.stream(
+                    self.core_v1.list_namespaced_pod,
+                    namespace=self.namespace,
+                    label_selector=f"session-id={session_id}",
+                    timeout_seconds=max(1, int(remaining)),
+                ):
+                    pod = event["object"]
+
+                    # Check if pod is running and its container is ready
+                    if (
+                        pod.status.phase == "Running"
+                        and pod.status.container_statuses
+                        and pod.status.container_statuses[0].ready
+                    ):
+                        watcher.stop()
+                        return {
+                            "pod_name": pod.metadata.name,
+                            "pod_ip": pod.status.pod_ip,
+                            "node_name": pod.spec.node_name,
+                        }
 
-                if pods.items:
-                    pod = pods.items[0]
-
-                    # Check if pod is ready
-                    if pod.status.phase == "Running":
-                        # Check if container is ready
-                        if pod.status.container_statuses:
-                            container_status = pod.status.container_statuses[0]
-                            if container_status.ready:
-                                return {
-                                    "pod_name": pod.metadata.name,
-                                    "pod_ip": pod.status.pod_ip,
-                                    "node_name": pod.spec.node_name,
-                                }
-
-                await asyncio.sleep(1)
-
-            except ApiException as e:
-                print(f"Error checking pod status: {e}")
-                await asyncio.sleep(1)
-
-        raise TimeoutError(
-            f"Pod for session {session_id} did not become ready within {timeout}s"
-        )
+            except (ApiException, urllib3.exceptions.HTTPError) as e:
+                # Stream dropped or API error; restart the watch after a short pause
+                logger.error("Error watching pod status: %s", e)
+                time.sleep(1)
+
+        return None
 
     async def create_session(self, request):
         """Handle session creation request."""
         try:
             session_id = self._generate_session_id()
-            print(f"[{datetime.now().isoformat()}] Creating session: {session_id}")
+            logger.info("Creating session: %s", session_id)
 
             # If pool size is 0, return direct WebSocket connection
             if self.pool_size == 0:
-                print(
-                    f"[{datetime.now().isoformat()}] Pool disabled, using direct WebSocket connection"
-                )
+                logger.info("Pool disabled, using direct WebSocket connection")
                 response = {
                     "session_id": session_id,
                     "status": "ready",
@@ -288,59 +384,55 @@ class SessionProvisioner:
                     "websocket_url": "wss://resume-showcase.k3s.christianmoore.me/ws",
                     "node_name": None,
                 }
-                return web.json_response(response)
+                return json_response(response)
 
             # Try to get a warm pod from the pool
             pod_details = None
             if self.available_pods:
                 pod_details = self.available_pods.pop(0)
-                print(
-                    f"[{datetime.now().isoformat()}] Assigned warm pod {pod_details['pod_name']} to session {session_id}"
+                logger.info(
+                    "Assigned warm pod %s to session %s",
+                    pod_details["pod_name"],
+                    session_id,
                 )
 
                 # Update pod labels to mark it as assigned
                 try:
-                    pod = self.core_v1.read_namespaced_pod(
-                        name=pod_details["pod_name"], namespace=self.namespace
+                    pod = await asyncio.to_thread(
+                        self.core_v1.read_namespaced_pod,
+                        name=pod_details["pod_name"],
+                        namespace=self.namespace,
                     )
                     pod.metadata.labels["assigned"] = "true"
                     pod.metadata.labels["session-id"] = session_id
-                    self.core_v1.patch_namespaced_pod(
+                    await asyncio.to_thread(
+                        self.core_v1.patch_namespaced_pod,
                         name=pod_details["pod_name"],
                         namespace=self.namespace,
                         body=pod,
                     )
                 except Exception as e:
-                    print(
-                        f"[{datetime.now().isoformat()}] Warning: Failed to update pod labels: {e}"
-                    )
+                    logger.warning("Failed to update pod labels: %s", e)
 
-                # Trigger pool replenishment asynchronously
-                asyncio.create_task(self._replenish_pool())
+                # Wake the pool maintenance task to replenish
+                self.replenish_trigger.set()
 
             else:
                 # No warm pods available, create one on-demand
-                print(
-                    f"[{datetime.now().isoformat()}] No warm pods available, creating new pod for session: {session_id}"
+                logger.info(
+                    "No warm pods available, creating new pod for session: %s",
+                    session_id,
                 )
 
                 # Create Job
-                job_manifest = self._create_job_manifest(session_id)
+                await self._create_job(self._job_template, session_id)
 
-                self.batch_v1.create_namespaced_job(
-                    namespace=self.namespace, body=job_manifest
-                )
-
-                print(
-                    f"[{datetime.now().isoformat()}] Job created for session: {session_id}"
-                )
+                logger.info("Job created for session: %s", session_id)
 
                 # Wait for pod to be ready
                 pod_details = await self._wait_for_pod_ready(session_id)
 
-                print(
-                    f"[{datetime.now().isoformat()}] Pod ready for session: {session_id}"
-                )
+                logger.info("Pod ready for session: %s", session_id)
 
             # Return session details
             response = {
@@ -351,42 +443,29 @@ class SessionProvisioner:
                 "node_name": pod_details.get("node_name"),
             }
 
-            return web.json_response(response)
+            return json_response(response)
 
         except TimeoutError as e:
-            print(f"[{datetime.now().isoformat()}] Session creation timeout: {e}")
-            return web.json_response(
+            logger.warning("Session creation timeout: %s", e)
+            return json_response(
                 {"error": "Session creation timeout", "message": str(e)}, status=504
             )
 
         except ApiException as e:
-            print(f"[{datetime.now().isoformat()}] Kubernetes API error: {e}")
-            return web.json_response(
+            logger.error("Kubernetes API error: %s", e)
+            return json_response(
                 {"error": "Failed to create session", "message": str(e)}, status=500
             )
 
         except Exception as e:
-            print(f"[{datetime.now().isoformat()}] Unexpected error: {e}")
-            return web.json_response(
+            logger.error("Unexpected error: %s", e)
+            return json_response(
                 {"error": "Internal server error", "message": str(e)}, status=500
             )
 
-    async def _replenish_pool(self):
-        """Replenish the pod pool in the background."""
-        if len(self.available_pods) < self.pool_size:
-            print(
-                f"[{datetime.now().isoformat()}] Replenishing pod pool ({len(self.available_pods)}/{self.pool_size})..."
-            )
-            session_id = self._generate_session_id()
-            await self._create_warm_pod(session_id)
-
-    async def health_check(self, request):
-        """Health check endpoint."""
-        return web.Response(text="OK")
-
     def create_app(self):
         """Create the aiohttp web application."""
-        app = web.Application()
+        app = web.Application(middlewares=[health_check])
 
         # Configure CORS
         cors = cors_setup(
@@ -405,15 +484,16 @@ class SessionProvisioner:
         session_resource = cors.add(app.router.add_resource("/session"))
         cors.add(session_resource.add_route("POST", self.create_session))
 
-        health_resource = cors.add(app.router.add_resource("/health"))
-        cors.add(health_resource.add_route("GET", self.health_check))
-
         return app
 
 
 async def main():
     provisioner = SessionProvisioner()  # Use POOL_SIZE env var (default: 4)
 
+    # Kubernetes calls run in the default executor, and each pod readiness watch
+    # holds a thread for its duration, so size it beyond asyncio's CPU-based default
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=32))
+
     # Initialize the pod pool
     await provisioner.initialize_pod_pool()
 
@@ -428,13 +508,11 @@ async def main():
     site = web.TCPSite(runner, "0.0.0.0", 8081)
     await site.start()
 
-    print(
-        f"[{datetime.now().isoformat()}] Session provisioner running on http://0.0.0.0:8081"
-    )
+    logger.info("Session provisioner running on http://0.0.0.0:8081")
 
     # Run forever
     await asyncio.Event().wait()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    uvloop.run(main())